@@ -1,26 +1,64 @@
-import json
+import orjson
 import csv
 import os
 import sys
-from typing import Dict, List, Any, Optional
-import pandas as pd
-from groq import Groq
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple
+import aiofiles
+import aiofiles.os
 import getpass
 from datetime import datetime
 import re
 import time
-from tqdm import tqdm
-import colorama
-from colorama import Fore, Style
+import random
+import math
+import hashlib
+import argparse
+
+# ⭐ ENHANCEMENT: Colorize only on a TTY; colorama is optional
+USE_COLOR = sys.stdout.isatty()
+if USE_COLOR:
+    try:
+        import colorama
+        from colorama import Fore, Style
+        # Initialize colorama for colored output
+        colorama.init()
+    except ImportError:
+        USE_COLOR = False
+
+if not USE_COLOR:
+    class _NoColor:
+        def __getattr__(self, name: str) -> str:
+            return ''
+
+    Fore = Style = _NoColor()
+
+_FK_DESC_RE = re.compile(r'Foreign key\s*→\s*(\w+)\.(\w+)', re.IGNORECASE)
+
+_TASK_GUIDELINES = """- Decide which schema contains ALL required data.
+- Write SQL ONLY if data exists in ONE schema.
+- If joining tables, confirm they share a relationship.
+- BE TRANSPARENT in assumptions — explain your validation steps.
+- SCORE CONFIDENCE HONESTLY — no overconfidence, no predefined buckets.
+"""
 
-# Initialize colorama for colored output
-colorama.init()
+class TruncatedResponseError(ValueError):
+    """The completion stopped at max_tokens before the JSON was complete"""
 
 class SQLGenerationPipeline:
     def __init__(self):
         self.groq_client = None
+        self.async_client = None
+        self._api_key = None
         self.sales_schema = None
         self.marketing_schema = None
+        self._sales_schema_text = ''
+        self._marketing_schema_text = ''
+        self._system_prompt = ''
+        self._prompt_hash = ''
         self.questions = []
         self.results = []
         self.token_usage = []
@@ -28,9 +66,20 @@ class SQLGenerationPipeline:
         self.config = {
             'model': 'llama-3.3-70b-versatile',
             'temperature': 0.1,
-            'max_tokens': 2000,
+            'max_tokens': 700,
+            'min_max_tokens': 500,
+            'max_tokens_warmup': 5,
+            'max_tokens_ceiling': 4096,
             'retry_attempts': 3,
-            'retry_delay': 2
+            'retry_delay': 2,
+            'max_retry_delay': 60,
+            'max_concurrency': 10,
+            'batch_size': 1,
+            'stream': False,
+            'batch_api': False,
+            'max_connections': 64,
+            'cache_user': 'sql-pipeline',
+            'cache_dir': os.path.join('output', '.llm_cache')
         }
 
     def configure_pipeline(self):
@@ -41,6 +90,10 @@ class SQLGenerationPipeline:
         print(f"Temperature: {self.config['temperature']}")
         print(f"Max Tokens: {self.config['max_tokens']}")
         print(f"Retry Attempts: {self.config['retry_attempts']}")
+        print(f"Max Concurrency: {self.config['max_concurrency']}")
+        print(f"Questions per Call: {self.config['batch_size']}")
+        print(f"Streaming: {self.config['stream']}")
+        print(f"Batch API Mode: {self.config['batch_api']}")
 
     # ⭐ ENHANCEMENT: Parse flexible question selection (ranges, commas, mixed)
     def parse_question_selection(self, total_questions: int) -> List[int]:
@@ -85,13 +138,19 @@ class SQLGenerationPipeline:
 
     def load_schemas(self):
         try:
-            with open('sales_dw.json', 'r') as f:
-                self.sales_schema = json.load(f)
+            with open('sales_dw.json', 'rb') as f:
+                self.sales_schema = orjson.loads(f.read())
             print(f"{Fore.GREEN}✓{Style.RESET_ALL} Loaded sales_dw schema")
             
-            with open('marketing_dw.json', 'r') as f:
-                self.marketing_schema = json.load(f)
+            with open('marketing_dw.json', 'rb') as f:
+                self.marketing_schema = orjson.loads(f.read())
             print(f"{Fore.GREEN}✓{Style.RESET_ALL} Loaded marketing_dw schema")
+
+            # ⭐ ENHANCEMENT: Schemas are fixed for the run — render prompt text once
+            self._sales_schema_text = self.format_schema_for_prompt(self.sales_schema)
+            self._marketing_schema_text = self.format_schema_for_prompt(self.marketing_schema)
+            self._system_prompt = self.build_system_prompt()
+            self._prompt_hash = hashlib.blake2b(self._system_prompt.encode(), digest_size=16).hexdigest()
         except Exception as e:
             print(f"{Fore.RED}Error loading schemas: {e}{Style.RESET_ALL}")
             sys.exit(1)
@@ -112,6 +171,10 @@ class SQLGenerationPipeline:
             sys.exit(1)
 
     def initialize_groq(self):
+        # Deferred so --help and an early Ctrl-C at the key prompt don't pay for these imports
+        from groq import Groq
+        import httpx
+
         print(f"\n{Fore.YELLOW}Groq API Configuration{Style.RESET_ALL}")
         print("="*50)
         
@@ -123,18 +186,24 @@ class SQLGenerationPipeline:
                 print(f"{Fore.RED}✗ API key cannot be empty. Try again.{Style.RESET_ALL}")
                 continue
 
+            client = None
             try:
-                self.groq_client = Groq(api_key=api_key)
+                # SDK retries are off (max_retries=0) so compute_retry_delay is the only retry policy
+                client = Groq(api_key=api_key, max_retries=0, http_client=httpx.Client(**self.http_client_options()))
                 # Test the connection with a minimal call
-                test_response = self.groq_client.chat.completions.create(
+                test_response = client.chat.completions.create(
                     model=self.config['model'],
                     messages=[{"role": "user", "content": "Hello"}],
                     max_tokens=5
                 )
+                self.groq_client = client
+                self._api_key = api_key
                 print(f"\n{Fore.GREEN}✅ Success! Groq API key validated and connection established.{Style.RESET_ALL}")
                 return  # Exit successfully
             
             except Exception as e:
+                if client is not None:
+                    client.close()
                 print(f"{Fore.RED}✗ API Key Invalid or Network Error (Attempt {attempt}): {str(e)}{Style.RESET_ALL}")
                 if attempt < max_retries:
                     print(f"{Fore.YELLOW}→ Please try again...{Style.RESET_ALL}\n")
@@ -143,73 +212,70 @@ class SQLGenerationPipeline:
                     print(f"{Fore.MAGENTA}💡 Tip: Ensure you're using a valid Groq API key from https://console.groq.com/keys{Style.RESET_ALL}")
                     sys.exit(1)
 
+    def create_async_client(self):
+        from groq import AsyncGroq
+        import httpx
+        return AsyncGroq(api_key=self._api_key, max_retries=0, http_client=httpx.AsyncClient(**self.http_client_options()))
+
+    # ⭐ ENHANCEMENT: Larger keep-alive pool + HTTP/2 so concurrent calls reuse connections
+    def http_client_options(self) -> Dict[str, Any]:
+        import httpx
+        return {
+            'http2': True,
+            'limits': httpx.Limits(max_connections=self.config['max_connections'],
+                                   max_keepalive_connections=self.config['max_connections']),
+            'timeout': httpx.Timeout(60.0, connect=10.0)
+        }
+
+    # ⭐ ENHANCEMENT: Compact table(col:type, ...) rendering — same information, far fewer tokens
     def format_schema_for_prompt(self, schema: Dict) -> str:
-        schema_text = f"Database: {schema['database']}\n\n"
+        lines = [f"{schema['database']}:"]
+        fks = []
         for table_name, table_info in schema['tables'].items():
-            schema_text += f"📊 Table: {table_name}\nColumns:\n"
-            for col_name, col_info in table_info['columns'].items():
-                schema_text += f"  - {col_name}: {col_info['type']} — {col_info['description']}\n"
-            if 'relationships' in table_info:
-                schema_text += "🔗 Relationships:\n"
-                for rel in table_info['relationships']:
-                    schema_text += f"  - {rel}\n"
-            schema_text += "\n"
-        return schema_text
-
+            cols = table_info['columns']
+            col_list = ', '.join(f"{c}:{info['type']}" for c, info in cols.items())
+            lines.append(f"{table_name}({col_list})")
+            for col_name, col_info in cols.items():
+                match = _FK_DESC_RE.search(col_info.get('description', ''))
+                if match:
+                    fks.append(f"FK: {table_name}.{col_name}={match.group(1)}.{match.group(2)}")
+            fks.extend(f"FK: {rel}" for rel in table_info.get('relationships', []))
+        return '\n'.join(lines + fks)
+
+    # ⭐ ENHANCEMENT: sqlglot normalizes the SQL; T-SQL parsing is only a fallback for TOP / DATE_SUB style output
     def validate_and_fix_sql(self, sql: str, target_source: str) -> str:
-        sql = sql.rstrip(';')
-        if 'TOP ' in sql.upper():
-            match = re.search(r'TOP\s+(\d+)', sql, re.IGNORECASE)
-            if match:
-                limit_num = match.group(1)
-                sql = re.sub(r'SELECT\s+TOP\s+\d+', 'SELECT', sql, flags=re.IGNORECASE)
-                if 'LIMIT' not in sql.upper():
-                    sql += f' LIMIT {limit_num}'
-        sql = re.sub(r'DATE_SUBKATEX_INLINE_OPENCURRENT_DATE,\s*INTERVAL\s+(\d+)\s+(\w+)KATEX_INLINE_CLOSE',
-                     r"CURRENT_DATE - INTERVAL '\1 \2'", sql, flags=re.IGNORECASE)
-        sql = re.sub(r"INTERVAL\s+'(\d+)'\s+DAY", r"INTERVAL '\1 day'", sql, flags=re.IGNORECASE)
-        sql = re.sub(r"INTERVAL\s+'(\d+)'\s+MONTH", r"INTERVAL '\1 month'", sql, flags=re.IGNORECASE)
-        sql = re.sub(r"INTERVAL\s+'(\d+)'\s+YEAR", r"INTERVAL '\1 year'", sql, flags=re.IGNORECASE)
+        import sqlglot
+        cleaned = sql.rstrip().rstrip(';')
+        for dialect in ('postgres', 'tsql'):
+            try:
+                statements = sqlglot.transpile(cleaned, read=dialect, write='postgres', identify=False)
+            except sqlglot.errors.SqlglotError:
+                continue
+            # Never silently drop statements after the first
+            return statements[0] if len(statements) == 1 else sql
         return sql
 
     def extract_json_from_response(self, text: str) -> Optional[Dict]:
-        text = text.replace('```json', '').replace('```', '')
+        # Non-streamed requests use response_format=json_object, so the reply is already valid JSON
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+        # Streamed replies may wrap the object in a code fence or stray text
         start_idx = text.find('{')
         end_idx = text.rfind('}')
-        if start_idx == -1 or end_idx == -1:
+        if start_idx == -1 or end_idx < start_idx:
             return None
-        json_str = text[start_idx:end_idx + 1]
-        lines = json_str.split('\n')
-        cleaned_lines = []
-        in_string = False
-        for line in lines:
-            quote_count = line.count('"') - line.count('\\"')
-            if quote_count % 2 == 1:
-                in_string = not in_string
-            if in_string and cleaned_lines:
-                cleaned_lines[-1] += ' ' + line.strip()
-            else:
-                cleaned_lines.append(line.strip())
-        json_str = '\n'.join(cleaned_lines)
         try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            json_str = re.sub(r',\s*}', '}', json_str)
-            json_str = re.sub(r',\s*]', ']', json_str)
-            try:
-                return json.loads(json_str)
-            except:
-                return None
-
-    def generate_sql_for_question(self, question_data: Dict, attempt: int = 1) -> Dict:
-        question = question_data['question']
-        question_id = question_data['question_id']
-
-        sales_schema_text = self.format_schema_for_prompt(self.sales_schema)
-        marketing_schema_text = self.format_schema_for_prompt(self.marketing_schema)
+            return orjson.loads(text[start_idx:end_idx + 1])
+        except orjson.JSONDecodeError:
+            return None
 
+    # ⭐ ENHANCEMENT: Invariant prefix (role + schemas) built once and kept byte-identical
+    # across calls so the provider can reuse its prompt cache
+    def build_system_prompt(self) -> str:
         # ⭐ ENHANCEMENT: Removed prescriptive confidence scale — AI decides freely
-        system_prompt = f"""You are an expert SQL architect. Generate ANSI SQL ONLY IF all required data exists within ONE schema.
+        return f"""You are an expert SQL architect. Generate ANSI SQL ONLY IF all required data exists within ONE schema.
 
 🧠 YOU MUST THINK STEP-BY-STEP AND SELF-ASSESS:
 
@@ -226,8 +292,8 @@ class SQLGenerationPipeline:
 
 📤 OUTPUT FORMAT (STRICT JSON — NO EXTRA TEXT):
 {{
-  "question_id": {question_id},
-  "question": "{question}",
+  "question_id": <question ID from the user message>,
+  "question": "<question text from the user message>",
   "target_source": "sales_dw | marketing_dw | N/A",
   "sql": "SELECT ... ; OR '-- Cannot generate: [reason]'",
   "assumptions": "Your detailed reasoning — what you validated, what you assumed",
@@ -235,86 +301,256 @@ class SQLGenerationPipeline:
 }}
 
 ⚠️ NEVER BLUFF. If unsure → confidence low. You are graded on honesty and reasoning depth.
-"""
 
-        user_prompt = f"""🔍 AVAILABLE SCHEMAS — YOU MUST VALIDATE TABLE EXISTENCE:
+🔍 AVAILABLE SCHEMAS — YOU MUST VALIDATE TABLE EXISTENCE:
 
 🔷 SALES DATA WAREHOUSE:
-{sales_schema_text}
+{self._sales_schema_text}
 
 🔷 MARKETING DATA WAREHOUSE:
-{marketing_schema_text}
+{self._marketing_schema_text}
+---END SCHEMA---
+"""
 
-❓ QUESTION TO ANSWER:
-Question ID: {question_id}
-Question: "{question}"
+    def build_messages(self, question_data: Dict) -> List[Dict]:
+        user_prompt = f"""❓ QUESTION TO ANSWER:
+Question ID: {question_data['question_id']}
+Question: "{question_data['question']}"
 
 ✅ YOUR TASK:
-- Decide which schema contains ALL required data.
-- Write SQL ONLY if data exists in ONE schema.
-- If joining tables, confirm they share a relationship.
-- BE TRANSPARENT in assumptions — explain your validation steps.
-- SCORE CONFIDENCE HONESTLY — no overconfidence, no predefined buckets.
-"""
+{_TASK_GUIDELINES}"""
 
-        try:
-            start_time = time.time()
-            response = self.groq_client.chat.completions.create(
-                model=self.config['model'],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=self.config['temperature'],
-                max_tokens=self.config['max_tokens']
-            )
-            end_time = time.time()
+        return [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
 
-            # ⭐ ENHANCEMENT: Track tokens and latency
-            usage = response.usage
+    def build_batch_messages(self, batch: List[Dict]) -> List[Dict]:
+        questions = "\n".join(f"Question ID: {q['question_id']}\nQuestion: \"{q['question']}\"\n" for q in batch)
+        user_prompt = f"""❓ QUESTIONS TO ANSWER:
+{questions}
+✅ YOUR TASK:
+Answer ALL of the above {len(batch)} questions independently.
+Return a JSON object {{"results": [...]}} whose array holds {len(batch)} objects in the OUTPUT FORMAT above, in the same order.
+{_TASK_GUIDELINES}"""
+
+        return [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def record_usage(self, question_id: int, usage, latency: float, batch_size: int = 1):
+        # ⭐ ENHANCEMENT: Track tokens and latency
+        if usage is not None:
             self.token_usage.append({
                 'question_id': question_id,
+                'batch_size': batch_size,
                 'prompt_tokens': usage.prompt_tokens,
                 'completion_tokens': usage.completion_tokens,
                 'total_tokens': usage.total_tokens
             })
-            self.latency_log.append({
-                'question_id': question_id,
-                'latency_sec': round(end_time - start_time, 2)
-            })
-
-            response_text = response.choices[0].message.content.strip()
-            result = self.extract_json_from_response(response_text)
-
-            if result is None:
-                raise ValueError("Failed to parse LLM response as JSON")
+        self.latency_log.append({
+            'question_id': question_id,
+            'latency_sec': round(latency, 2)
+        })
+
+    # ⭐ ENHANCEMENT: Size max_tokens from observed completions (p99 + 20% headroom)
+    def adapt_max_tokens(self):
+        if len(self.token_usage) < self.config['max_tokens_warmup']:
+            return
+        completions = sorted(t['completion_tokens'] / t['batch_size'] for t in self.token_usage)
+        p99 = completions[math.ceil(0.99 * len(completions)) - 1]
+        self.config['max_tokens'] = max(self.config['min_max_tokens'], int(p99 * 1.2))
+
+    def parse_response(self, response_text: str, question_data: Dict) -> Dict:
+        result = self.extract_json_from_response(response_text.strip())
+
+        if result is None:
+            raise ValueError("Failed to parse LLM response as JSON")
+
+        return self.finalize_result(result, question_data)
+
+    def finalize_result(self, result: Dict, question_data: Dict) -> Dict:
+        result.setdefault('question_id', question_data['question_id'])
+        result.setdefault('question', question_data['question'])
+        result.setdefault('target_source', 'N/A')
+        result.setdefault('sql', '-- Error parsing response')
+        result.setdefault('assumptions', 'AI did not provide reasoning')
+        result.setdefault('confidence', 0.0)
+
+        if result.get('confidence', 0) > 0 and 'sql' in result and not result['sql'].startswith('--'):
+            result['sql'] = self.validate_and_fix_sql(result['sql'], result.get('target_source', ''))
+
+        return result
+
+    def error_result(self, question_data: Dict, error: Exception, attempts: int) -> Dict:
+        return {
+            "question_id": question_data['question_id'],
+            "question": question_data['question'],
+            "target_source": "Unknown",
+            "sql": "-- Error during generation",
+            "assumptions": f"System error after {attempts} attempt(s): {str(error)}",
+            "confidence": 0.0
+        }
 
-            result.setdefault('question_id', question_id)
-            result.setdefault('question', question)
-            result.setdefault('target_source', 'N/A')
-            result.setdefault('sql', '-- Error parsing response')
-            result.setdefault('assumptions', 'AI did not provide reasoning')
-            result.setdefault('confidence', 0.0)
+    def is_json_generation_error(self, error: Exception) -> bool:
+        """Groq reports a reply that failed JSON mode as HTTP 400 json_validate_failed"""
+        if getattr(error, 'status_code', None) != 400:
+            return False
+        body = getattr(error, 'body', None)
+        if isinstance(body, dict):
+            body = body.get('error', body)
+            return isinstance(body, dict) and body.get('code') == 'json_validate_failed'
+        return 'json_validate_failed' in str(error)
+
+    # ⭐ ENHANCEMENT: Exponential backoff with jitter, honoring Retry-After on 429s
+    def compute_retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the error should not be retried"""
+        from groq import APIStatusError, RateLimitError
+        backoff = self.config['retry_delay'] * 2 ** (attempt - 1)
+        if isinstance(error, RateLimitError):
+            retry_after = error.response.headers.get('retry-after')
+            try:
+                return float(retry_after)
+            except (TypeError, ValueError):
+                return min(self.config['max_retry_delay'], backoff + random.random())
+        if isinstance(error, APIStatusError):
+            if error.status_code >= 500 or error.status_code in (408, 409) or self.is_json_generation_error(error):
+                return min(self.config['max_retry_delay'], backoff)
+            return None  # auth/validation errors (401, 403, 404, 422, ...) won't succeed on retry — fail fast
+        return min(self.config['max_retry_delay'], backoff + random.random())
+
+    def retry_max_tokens(self, error: Exception, max_tokens: int) -> int:
+        """Double the token budget when the last reply ran out of room (truncated or failed JSON mode)"""
+        if isinstance(error, TruncatedResponseError) or self.is_json_generation_error(error):
+            return max(max_tokens, min(self.config['max_tokens_ceiling'], max_tokens * 2))
+        return max_tokens
+
+    # ⭐ ENHANCEMENT: Optionally stream the completion so it is consumed while it is generated
+    async def _complete_async(self, messages: List[Dict], max_tokens: int) -> Tuple[str, Any, Optional[str]]:
+        """Return the completion text, its token usage (None if the stream did not report it) and finish reason"""
+        request = {
+            'model': self.config['model'],
+            'messages': messages,
+            'temperature': self.config['temperature'],
+            'max_tokens': max_tokens,
+            'user': self.config['cache_user']
+        }
+        if not self.config['stream']:
+            response = await self.async_client.chat.completions.create(**request, response_format={"type": "json_object"})
+            choice = response.choices[0]
+            return choice.message.content, response.usage, choice.finish_reason
+
+        # JSON mode isn't guaranteed on streamed requests, so rely on the prompt and
+        # let extract_json_from_response trim any text around the object
+        chunks = []
+        usage = None
+        finish_reason = None
+        async for chunk in await self.async_client.chat.completions.create(**request, stream=True):
+            if chunk.choices:
+                chunks.append(chunk.choices[0].delta.content or '')
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            x_groq = getattr(chunk, 'x_groq', None)
+            if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                usage = x_groq.usage
+        return ''.join(chunks), usage, finish_reason
+
+    # ⭐ ENHANCEMENT: Async so many questions can be in flight at once
+    async def generate_sql_for_question_async(self, question_data: Dict, attempt: int = 1,
+                                              max_tokens: Optional[int] = None) -> Dict:
+        question_id = question_data['question_id']
+        max_tokens = max_tokens or self.config['max_tokens']
+        if attempt == 1:
+            cached = await self.load_cached_result_async(question_data)
+            if cached is not None:
+                return cached
 
-            if result.get('confidence', 0) > 0 and 'sql' in result and not result['sql'].startswith('--'):
-                result['sql'] = self.validate_and_fix_sql(result['sql'], result.get('target_source', ''))
+        try:
+            start_time = time.time()
+            content, usage, finish_reason = await self._complete_async(self.build_messages(question_data), max_tokens)
+            self.record_usage(question_id, usage, time.time() - start_time)
+            if finish_reason == 'length':
+                raise TruncatedResponseError(f"Response truncated at max_tokens={max_tokens}")
+            result = self.parse_response(content, question_data)
 
-            return result
+        except Exception as e:
+            delay = self.compute_retry_delay(e, attempt)
+            if delay is not None and attempt < self.config['retry_attempts']:
+                print(f"{Fore.YELLOW}  Retry {attempt}/{self.config['retry_attempts']} for Q{question_id} in {delay:.1f}s{Style.RESET_ALL}")
+                await asyncio.sleep(delay)
+                return await self.generate_sql_for_question_async(question_data, attempt + 1,
+                                                                  self.retry_max_tokens(e, max_tokens))
+
+            return self.error_result(question_data, e, attempt)
+
+        await self.save_cached_result_async(question_data, result)
+        return result
+
+    # ⭐ ENHANCEMENT: Answer several questions per call to amortize per-request overhead
+    async def generate_sql_for_batch_async(self, batch: List[Dict]) -> List[Dict]:
+        results = [await self.load_cached_result_async(q) for q in batch]
+        pending = [i for i, r in enumerate(results) if r is None]
+
+        if len(pending) > 1:
+            items = await self._request_batch_async([batch[i] for i in pending])
+            for i, item in zip(pending, items):
+                if item is None:
+                    continue
+                try:
+                    results[i] = self.finalize_result(item, batch[i])
+                except Exception:
+                    continue  # malformed entry — retried individually below
+                await self.save_cached_result_async(batch[i], results[i])
+
+        # Anything the batched call did not answer is re-issued on its own
+        for i, question_data in enumerate(batch):
+            if results[i] is None:
+                results[i] = await self.generate_sql_for_question_async(question_data)
+        return results
+
+    async def _request_batch_async(self, batch: List[Dict], attempt: int = 1,
+                                   max_tokens: Optional[int] = None) -> List[Optional[Dict]]:
+        max_tokens = max_tokens or self.config['max_tokens'] * len(batch)
+        try:
+            start_time = time.time()
+            content, usage, finish_reason = await self._complete_async(self.build_batch_messages(batch), max_tokens)
+            self.record_usage(batch[0]['question_id'], usage, time.time() - start_time, len(batch))
+            if finish_reason == 'length':
+                raise TruncatedResponseError(f"Batched response truncated at max_tokens={max_tokens}")
+            data = self.extract_json_from_response(content)
+            items = data.get('results') if isinstance(data, dict) else None
+            if not isinstance(items, list):
+                raise ValueError("Failed to parse batched LLM response as a JSON results array")
 
         except Exception as e:
-            if attempt < self.config['retry_attempts']:
-                print(f"{Fore.YELLOW}  Retry {attempt}/{self.config['retry_attempts']} for Q{question_id}{Style.RESET_ALL}")
-                time.sleep(self.config['retry_delay'])
-                return self.generate_sql_for_question(question_data, attempt + 1)
-
-            return {
-                "question_id": question_id,
-                "question": question,
-                "target_source": "Unknown",
-                "sql": "-- Error during generation",
-                "assumptions": f"System error after {self.config['retry_attempts']} retries: {str(e)}",
-                "confidence": 0.0
-            }
+            delay = self.compute_retry_delay(e, attempt)
+            if delay is not None and attempt < self.config['retry_attempts']:
+                print(f"{Fore.YELLOW}  Retry {attempt}/{self.config['retry_attempts']} for batch Q{batch[0]['question_id']}-Q{batch[-1]['question_id']} in {delay:.1f}s{Style.RESET_ALL}")
+                await asyncio.sleep(delay)
+                return await self._request_batch_async(batch, attempt + 1, self.retry_max_tokens(e, max_tokens))
+            return [None] * len(batch)
+
+        # Match answers by question_id; fall back to position only for items without one.
+        # Duplicate/unknown IDs or two answers for one question leave it unanswered (None)
+        # so it is re-issued individually rather than cached with the wrong answer.
+        index_by_id = {str(q['question_id']): i for i, q in enumerate(batch)}
+        id_counts = Counter(str(item['question_id']) for item in items
+                            if isinstance(item, dict) and item.get('question_id') is not None)
+        candidates: Dict[int, List[Dict]] = {}
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            qid = item.get('question_id')
+            if qid is None:
+                target = position if position < len(batch) else None
+            elif id_counts[str(qid)] == 1:
+                target = index_by_id.get(str(qid))
+            else:
+                target = None
+            if target is not None:
+                candidates.setdefault(target, []).append(item)
+        return [answers[0] if len(answers) == 1 else None
+                for answers in (candidates.get(i, []) for i in range(len(batch)))]
 
     def process_all_questions(self):
         print(f"\n{Fore.YELLOW}Generating SQL Queries — AI thinks, validates & scores freely{Style.RESET_ALL}")
@@ -322,26 +558,240 @@ Question: "{question}"
 
         # ⭐ ENHANCEMENT: Let user pick questions
         selected_ids = self.parse_question_selection(len(self.questions))
-        selected_questions = [q for q in self.questions if q['question_id'] in selected_ids]
+        selected_set = set(selected_ids)
+        selected_questions = [q for q in self.questions if q['question_id'] in selected_set]
 
         print(f"{Fore.CYAN}Processing {len(selected_questions)} selected questions: {selected_ids}{Style.RESET_ALL}")
 
+        # ⭐ ENHANCEMENT: Dispatch each distinct question once and fan the result out
+        unique: Dict[str, Dict] = {}
+        for q in selected_questions:
+            unique.setdefault(self.question_key(q['question']), q)
+
+        duplicates = len(selected_questions) - len(unique)
+        if duplicates:
+            print(f"{Fore.CYAN}Reusing results for {duplicates} duplicate questions{Style.RESET_ALL}")
+
+        if self.config['batch_api']:
+            generated = self.run_batch_job(list(unique.values()))
+        else:
+            generated = asyncio.run(self._gather(list(unique.values())))
+        by_key = dict(zip(unique.keys(), generated))
+
+        for q in selected_questions:
+            result = dict(by_key[self.question_key(q['question'])])
+            result['question_id'] = q['question_id']
+            result['question'] = q['question']
+            self.results.append(result)
+
+    def call_with_retry(self, fn, *args, **kwargs):
+        """Call a sync Groq API method, retrying transient failures per compute_retry_delay"""
+        attempt = 1
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.compute_retry_delay(e, attempt)
+                if delay is None or attempt >= self.config['retry_attempts']:
+                    raise
+                print(f"{Fore.YELLOW}  Retry {attempt}/{self.config['retry_attempts']} after error: {e} (waiting {delay:.1f}s){Style.RESET_ALL}")
+                time.sleep(delay)
+                attempt += 1
+
+    # ⭐ ENHANCEMENT: Offline mode via Groq's Batch API — half the cost, no per-minute rate limits
+    def run_batch_job(self, questions: List[Dict]) -> List[Dict]:
+        results = [self.load_cached_result(q) for q in questions]
+        pending = [q for q, r in zip(questions, results) if r is None]
+        if not pending:
+            return results
+
+        os.makedirs('output', exist_ok=True)
+        input_file = os.path.join('output', 'batch_input.jsonl')
+        with open(input_file, 'wb') as f:
+            for q in pending:
+                f.write(orjson.dumps({
+                    "custom_id": f"q{q['question_id']}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.config['model'],
+                        "messages": self.build_messages(q),
+                        "temperature": self.config['temperature'],
+                        "max_tokens": self.config['max_tokens'],
+                        "response_format": {"type": "json_object"}
+                    }
+                }) + b"\n")
+
+        batch = None
+        try:
+            with open(input_file, 'rb') as f:
+                uploaded = self.call_with_retry(self.groq_client.files.create, file=f, purpose='batch')
+            batch = self.groq_client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint='/v1/chat/completions',
+                completion_window='24h'
+            )
+            print(f"{Fore.CYAN}Submitted batch {batch.id} with {len(pending)} requests{Style.RESET_ALL}")
+
+            delay = 5
+            while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+                print(f"  Batch status: {batch.status} — checking again in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 300)
+                batch = self.call_with_retry(self.groq_client.batches.retrieve, batch.id)
+
+            if batch.status != 'completed' or not batch.output_file_id:
+                raise RuntimeError(f"Batch {batch.id} finished with status '{batch.status}'")
+            output = self.call_with_retry(lambda: self.groq_client.files.content(batch.output_file_id).read())
+        except Exception as e:
+            print(f"{Fore.RED}Batch job failed: {e} — falling back to live requests{Style.RESET_ALL}")
+            output = b""
+            # Don't leave a still-running job to be billed alongside the live requests
+            if batch is not None and batch.status not in ('failed', 'expired', 'cancelled'):
+                try:
+                    self.groq_client.batches.cancel(batch.id)
+                except Exception as cancel_error:
+                    print(f"{Fore.RED}Could not cancel batch {batch.id}: {cancel_error}{Style.RESET_ALL}")
+
+        bodies = {}
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = orjson.loads(line)
+                response = entry.get('response') or {}
+                if response.get('status_code') == 200:
+                    bodies[entry['custom_id']] = response['body']
+            except (orjson.JSONDecodeError, AttributeError, KeyError, TypeError):
+                continue  # malformed line — its question is retried live below
+
+        for i, q in enumerate(questions):
+            if results[i] is not None:
+                continue
+            body = bodies.get(f"q{q['question_id']}")
+            if body is None:
+                continue
+            try:
+                results[i] = self.parse_response(body['choices'][0]['message']['content'], q)
+            except Exception:
+                continue
+            usage = body.get('usage') or {}
+            if usage:
+                self.token_usage.append({
+                    'question_id': q['question_id'],
+                    'batch_size': 1,
+                    'prompt_tokens': usage.get('prompt_tokens', 0),
+                    'completion_tokens': usage.get('completion_tokens', 0),
+                    'total_tokens': usage.get('total_tokens', 0)
+                })
+            self.save_cached_result(q, results[i])
+
+        # Questions the batch failed or left out go back through the live path
+        retry = [i for i, r in enumerate(results) if r is None]
+        if retry:
+            print(f"{Fore.YELLOW}Retrying {len(retry)} questions without a usable batch result via live requests{Style.RESET_ALL}")
+            live = asyncio.run(self._gather([questions[i] for i in retry]))
+            for i, result in zip(retry, live):
+                results[i] = result
+        return results
+
+    def question_key(self, question: str) -> str:
+        return hashlib.blake2b(question.strip().lower().encode(), digest_size=16).hexdigest()
+
+    # ⭐ ENHANCEMENT: Run-to-run cache keyed on model, temperature, prompt and question
+    def cache_path(self, question_data: Dict) -> str:
+        key_src = f"{self.config['model']}|{self.config['temperature']}|{self._prompt_hash}|{question_data['question'].strip().lower()}"
+        key = hashlib.blake2b(key_src.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.config['cache_dir'], f"{key}.json")
+
+    def load_cached_result(self, question_data: Dict) -> Optional[Dict]:
+        try:
+            with open(self.cache_path(question_data), 'rb') as f:
+                result = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        result['question_id'] = question_data['question_id']
+        result['question'] = question_data['question']
+        return result
+
+    def save_cached_result(self, question_data: Dict, result: Dict):
+        path = self.cache_path(question_data)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(self.config['cache_dir'], exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(result))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # cache is best-effort
+
+    # ⭐ ENHANCEMENT: Non-blocking cache I/O for the async path
+    async def load_cached_result_async(self, question_data: Dict) -> Optional[Dict]:
+        try:
+            async with aiofiles.open(self.cache_path(question_data), 'rb') as f:
+                result = orjson.loads(await f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        result['question_id'] = question_data['question_id']
+        result['question'] = question_data['question']
+        return result
+
+    async def save_cached_result_async(self, question_data: Dict, result: Dict):
+        path = self.cache_path(question_data)
+        tmp_path = f"{path}.tmp"
+        try:
+            await aiofiles.os.makedirs(self.config['cache_dir'], exist_ok=True)
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                await f.write(orjson.dumps(result))
+            await aiofiles.os.replace(tmp_path, path)
+        except OSError:
+            pass  # cache is best-effort
+
+    async def _bounded(self, sem: asyncio.Semaphore, index: int, chunk: List[Dict]) -> Tuple[int, List[Dict]]:
+        async with sem:
+            if len(chunk) == 1:
+                return index, [await self.generate_sql_for_question_async(chunk[0])]
+            return index, await self.generate_sql_for_batch_async(chunk)
+
+    async def _gather(self, selected_questions: List[Dict]) -> List[Dict]:
+        # The async client lives only as long as this event loop, so its HTTP/2
+        # connections are closed before asyncio.run tears the loop down
+        self.async_client = self.create_async_client()
+        try:
+            return await self._dispatch(selected_questions)
+        finally:
+            await self.async_client.close()
+            self.async_client = None
+
+    async def _dispatch(self, selected_questions: List[Dict]) -> List[Dict]:
+        from tqdm import tqdm
+        sem = asyncio.Semaphore(self.config['max_concurrency'])
+        size = max(1, self.config['batch_size'])
+        chunks = [selected_questions[i:i + size] for i in range(0, len(selected_questions), size)]
+        tasks = [self._bounded(sem, i, chunk) for i, chunk in enumerate(chunks)]
+        results = [None] * len(tasks)
+
         with tqdm(total=len(selected_questions), desc="Processing", 
                   bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]") as pbar:
-            
-            for question_data in selected_questions:
-                result = self.generate_sql_for_question(question_data)
-                self.results.append(result)
-                
-                conf = result.get('confidence', 0)
-                if conf >= 0.8:
-                    pbar.set_postfix_str(f"{Fore.GREEN}✓ Confident{Style.RESET_ALL}")
-                elif conf >= 0.5:
-                    pbar.set_postfix_str(f"{Fore.YELLOW}⚠ Unsure{Style.RESET_ALL}")
-                else:
-                    pbar.set_postfix_str(f"{Fore.RED}✗ Can't generate{Style.RESET_ALL}")
+
+            for done, next_done in enumerate(asyncio.as_completed(tasks), 1):
+                index, chunk_results = await next_done
+                results[index] = chunk_results
+                self.adapt_max_tokens()
+
+                # ⭐ ENHANCEMENT: Redraw the postfix every few completions, not on every one
+                if done % 5 == 0 or done == len(tasks):
+                    conf = chunk_results[-1].get('confidence', 0)
+                    if conf >= 0.8:
+                        pbar.set_postfix_str(f"{Fore.GREEN}✓ Confident{Style.RESET_ALL}", refresh=False)
+                    elif conf >= 0.5:
+                        pbar.set_postfix_str(f"{Fore.YELLOW}⚠ Unsure{Style.RESET_ALL}", refresh=False)
+                    else:
+                        pbar.set_postfix_str(f"{Fore.RED}✗ Can't generate{Style.RESET_ALL}", refresh=False)
                 
-                pbar.update(1)
+                pbar.update(len(chunk_results))
+
+        return [result for chunk_results in results for result in chunk_results]
 
     def save_results(self):
         output_dir = 'output'
@@ -357,24 +807,33 @@ Question: "{question}"
         print("5. All formats")
         
         export_choice = input(f"\n{Fore.CYAN}Select format (1-5, default 1): {Style.RESET_ALL}").strip() or '1'
-        files_created = []
-
+        def write_csv(csv_file: str):
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=['question_id', 'question', 'target_source', 'sql', 'assumptions', 'confidence'],
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.results)
+            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+                f.write(buffer.getvalue())
+
+        def write_json(json_file: str):
+            with open(json_file, 'wb') as f:
+                f.write(orjson.dumps(self.results, option=orjson.OPT_INDENT_2))
+
+        exports = []
         if export_choice in ['1', '3', '4', '5']:
-            csv_file = f"{output_dir}/queries_{timestamp}.csv"
-            df = pd.DataFrame(self.results)[['question_id', 'question', 'target_source', 'sql', 'assumptions', 'confidence']]
-            df.to_csv(csv_file, index=False, encoding='utf-8')
-            files_created.append(csv_file)
-
+            exports.append((f"{output_dir}/queries_{timestamp}.csv", write_csv))
         if export_choice in ['2', '3', '5']:
-            json_file = f"{output_dir}/queries_{timestamp}.json"
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(self.results, f, indent=2, ensure_ascii=False)
-            files_created.append(json_file)
-
+            exports.append((f"{output_dir}/queries_{timestamp}.json", write_json))
         if export_choice in ['4', '5']:
-            md_file = f"{output_dir}/report_{timestamp}.md"
-            self.generate_markdown_report(md_file)
-            files_created.append(md_file)
+            exports.append((f"{output_dir}/report_{timestamp}.md", self.generate_markdown_report))
+
+        # ⭐ ENHANCEMENT: Exports are independent — write them in parallel
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(write, path) for path, write in exports]
+            for future in futures:
+                future.result()
+        files_created = [path for path, _ in exports]
 
         print(f"\n{Fore.GREEN}Files created:{Style.RESET_ALL}")
         for file in files_created:
@@ -383,45 +842,62 @@ Question: "{question}"
         self.print_summary_statistics()
 
     def generate_markdown_report(self, filename: str):
+        # ⭐ ENHANCEMENT: Build the report in memory and write it in one go
+        total = len(self.results)
+        success = high = 0
+        low_conf = []
+        for r in self.results:
+            if r['confidence'] > 0:
+                success += 1
+            if r['confidence'] >= 0.8:
+                high += 1
+            if r['confidence'] < 0.5 and len(low_conf) < 3:
+                low_conf.append(r)
+
+        parts: List[str] = [
+            "# 🧠 AI-Powered SQL Generation Report\n\n",
+            f"**Generated on**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  \n",
+            f"**Model**: {self.config['model']}  \n",
+            f"**Temperature**: {self.config['temperature']}  \n\n",
+            "## 📊 Executive Summary\n",
+            f"- Total Questions: **{total}**  \n",
+            f"- Successfully Generated: **{success}**  \n",
+            f"- High Confidence (≥0.8): **{high}**  \n",
+            f"- Success Rate: **{success/total*100:.1f}%**  \n\n",
+            "## 🤖 Sample AI Reasoning (Low Confidence Cases)\n"
+        ]
+        for r in low_conf:
+            parts.append(f"\n### ❓ Question {r['question_id']}: {r['question']}\n")
+            parts.append(f"- **Confidence**: `{r['confidence']}`  \n")
+            parts.append(f"- **Assumptions**: {r['assumptions']}  \n")
+            parts.append(f"- **SQL**: `{r['sql']}`  \n")
+
+        parts.append("\n## 📝 Full Query Results\n")
+        for r in self.results:
+            parts.append(f"\n### 🔍 Question {r['question_id']}: {r['question']}\n")
+            parts.append(f"- **Target Source**: `{r['target_source']}`  \n")
+            parts.append(f"- **Confidence**: `{r['confidence']}`  \n")
+            parts.append(f"- **Assumptions**: {r['assumptions']}  \n")
+            parts.append("**SQL**:\n```sql\n" + r['sql'] + "\n```\n---")
+
         with open(filename, 'w', encoding='utf-8') as f:
-            f.write("# 🧠 AI-Powered SQL Generation Report\n\n")
-            f.write(f"**Generated on**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  \n")
-            f.write(f"**Model**: {self.config['model']}  \n")
-            f.write(f"**Temperature**: {self.config['temperature']}  \n\n")
-
-            total = len(self.results)
-            success = sum(1 for r in self.results if r['confidence'] > 0)
-            high = sum(1 for r in self.results if r['confidence'] >= 0.8)
-
-            f.write("## 📊 Executive Summary\n")
-            f.write(f"- Total Questions: **{total}**  \n")
-            f.write(f"- Successfully Generated: **{success}**  \n")
-            f.write(f"- High Confidence (≥0.8): **{high}**  \n")
-            f.write(f"- Success Rate: **{success/total*100:.1f}%**  \n\n")
-
-            f.write("## 🤖 Sample AI Reasoning (Low Confidence Cases)\n")
-            low_conf = [r for r in self.results if r['confidence'] < 0.5][:3]
-            for r in low_conf:
-                f.write(f"\n### ❓ Question {r['question_id']}: {r['question']}\n")
-                f.write(f"- **Confidence**: `{r['confidence']}`  \n")
-                f.write(f"- **Assumptions**: {r['assumptions']}  \n")
-                f.write(f"- **SQL**: `{r['sql']}`  \n")
-
-            f.write("\n## 📝 Full Query Results\n")
-            for r in self.results:
-                f.write(f"\n### 🔍 Question {r['question_id']}: {r['question']}\n")
-                f.write(f"- **Target Source**: `{r['target_source']}`  \n")
-                f.write(f"- **Confidence**: `{r['confidence']}`  \n")
-                f.write(f"- **Assumptions**: {r['assumptions']}  \n")
-                f.write("**SQL**:\n```sql\n" + r['sql'] + "\n```\n---")
+            f.write("".join(parts))
 
     def print_summary_statistics(self):
         print(f"\n{Fore.YELLOW}📊 FINAL REPORT{Style.RESET_ALL}")
         print("="*70)
 
+        # ⭐ ENHANCEMENT: Single pass over results for all summary stats
         total = len(self.results)
-        success = sum(1 for r in self.results if r['confidence'] > 0)
-        avg_conf = sum(r['confidence'] for r in self.results) / total if total > 0 else 0
+        success = 0
+        conf_sum = 0.0
+        sources = Counter()
+        for r in self.results:
+            if r['confidence'] > 0:
+                success += 1
+            conf_sum += r['confidence']
+            sources[r['target_source']] += 1
+        avg_conf = conf_sum / total if total > 0 else 0
 
         print(f"✅ Total Processed: {total}")
         print(f"🎯 AI Success Rate: {Fore.GREEN}{success}/{total} ({success/total*100:.1f}%){Style.RESET_ALL}")
@@ -442,10 +918,6 @@ Question: "{question}"
             print(f"  Avg Latency per Query: {avg_latency:.2f}s")
 
         print(f"\n{Fore.CYAN}Target Sources Chosen by AI:{Style.RESET_ALL}")
-        sources = {}
-        for r in self.results:
-            src = r['target_source']
-            sources[src] = sources.get(src, 0) + 1
         for src, count in sorted(sources.items()):
             print(f"  {src}: {count}")
 
@@ -465,9 +937,23 @@ Question: "{question}"
         self.save_results()
         print(f"\n{Fore.GREEN}✅ SQL Generation Completed{Style.RESET_ALL}")
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate SQL for business questions with the Groq API")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="Number of questions answered per LLM call (default 1; 4-8 works well)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Stream completions instead of waiting for the full response")
+    parser.add_argument('--batch', action='store_true',
+                        help="Submit all questions as one offline Groq Batch API job (cheaper, may take minutes to hours)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     try:
         pipeline = SQLGenerationPipeline()
+        pipeline.config['batch_size'] = args.batch_size
+        pipeline.config['stream'] = args.stream
+        pipeline.config['batch_api'] = args.batch
         pipeline.run()
     except KeyboardInterrupt:
         print(f"\n\n{Fore.YELLOW}Interrupted by user{Style.RESET_ALL}")